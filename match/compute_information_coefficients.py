@@ -0,0 +1,674 @@
+from math import exp, log, pi, sqrt
+
+from numba import get_num_threads, njit, prange
+from numpy import (ascontiguousarray, empty, empty_like, finfo, float64, inf,
+                   int64, isnan, uint32, zeros)
+from numpy.random import RandomState, randint, seed
+
+EPS = finfo(float).eps
+
+# Defaults of information.compute_information_coefficient
+N_GRIDS = 25
+JITTER = 1e-10
+RANDOM_SEED = 20121020
+
+# Number of bins of MASS::bcv
+N_BINS = 1000
+
+# Fast math without assuming values are never nan or inf because nan marks
+# missing values
+FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+
+def compute_information_coefficients(target, features, dtype=float64):
+    """
+    Drop nan from target and features[i] and compute: scores[i] =
+        compute_information_coefficient(target, features[i]) for all features
+        at once.
+    Arguments:
+        target (array): (n_samples); read as dtype
+        features (array): (n_features, n_samples); read as dtype
+        dtype (dtype): float64, or float32 to halve memory traffic; float32
+            is accurate to about 1e-7 only for values of order 1, such as
+            z-scores
+    Returns:
+        array: (n_features)
+    """
+
+    return _compute_information_coefficients(
+        ascontiguousarray(target, dtype=dtype),
+        ascontiguousarray(features, dtype=dtype),
+        make_jitters(target.size),
+        max(1, min(features.shape[0], get_num_threads())))
+
+
+def compute_information_coefficients_for_targets(targets,
+                                                 features,
+                                                 dtype=float64):
+    """
+    Drop nan from targets[j] and features[i] and compute: scores[i, j] =
+        compute_information_coefficient(targets[j], features[i]) for all
+        targets and features at once.
+    Arguments:
+        targets (array): (n_targets, n_samples); read as dtype
+        features (array): (n_features, n_samples); read as dtype
+        dtype (dtype): float64, or float32 for values of order 1
+    Returns:
+        array: (n_features, n_targets)
+    """
+
+    return _compute_information_coefficients_for_targets(
+        ascontiguousarray(targets, dtype=dtype),
+        ascontiguousarray(features, dtype=dtype),
+        make_jitters(targets.shape[1]))
+
+
+def permute_target_and_compute_information_coefficients(
+        target, features, random_seeds, dtype=float64):
+    """
+    Permute target once per random seed and compute: scores[i, j] =
+        compute_information_coefficient(permuted_target_j, features[i]),
+        dropping nan. Permutation j is seeded with random_seeds[j] so that a
+        block of permutations can be computed with its slice of random_seeds.
+    Arguments:
+        target (array): (n_samples); read as dtype
+        features (array): (n_features, n_samples); read as dtype
+        random_seeds (array): (n_permutations); read as uint32
+        dtype (dtype): float64, or float32 for values of order 1
+    Returns:
+        array: (n_features, n_permutations)
+    """
+
+    return _permute_target_and_compute_information_coefficients(
+        ascontiguousarray(target, dtype=dtype),
+        ascontiguousarray(features, dtype=dtype),
+        ascontiguousarray(random_seeds, dtype=uint32),
+        make_jitters(target.size),
+        max(1, min(len(random_seeds), get_num_threads())))
+
+
+def make_jitters(n_samples):
+    """
+    Make the jitters compute_information_coefficient adds after dropping nan:
+        x gets jitters[:n] and y gets jitters[n:2 * n] for n samples left.
+    Arguments:
+        n_samples (int):
+    Returns:
+        array: (2 * n_samples)
+    """
+
+    return RandomState(RANDOM_SEED).random_sample(2 * n_samples) * JITTER
+
+
+@njit(fastmath=FASTMATH, cache=True)
+def _has_nan(x):
+    """
+    Check if x has nan.
+    Arguments:
+        x (array): (n_samples)
+    Returns:
+        bool:
+    """
+
+    for j in range(x.size):
+        if isnan(x[j]):
+            return True
+
+    return False
+
+
+@njit(fastmath=FASTMATH, cache=True)
+def _compute_information_coefficients_serially(target, features, jitters,
+                                               scores, kernels):
+    """
+    Compute information coefficients between target and features[i] into
+        scores[i], preparing target once for all features.
+    Arguments:
+        target (array): (n_samples)
+        features (array): (n_features, n_samples)
+        jitters (array): (2 * n_samples)
+        scores (array): (n_features)
+        kernels (array): (2, N_GRIDS, n_samples); reused buffer
+    Returns:
+        None
+    """
+
+    # Features drop different samples when target has nan so prepare nothing
+    target_has_nan = _has_nan(target)
+    if target_has_nan:
+        prepared_target = _prepare_target(target[:0], jitters)
+    else:
+        prepared_target = _prepare_target(target, jitters)
+
+    for i in range(features.shape[0]):
+        if target_has_nan or _has_nan(features[i]):
+            scores[i] = _compute_information_coefficient(
+                target, features[i], jitters, kernels)
+        else:
+            scores[i] = _compute_information_coefficient_given_target(
+                prepared_target, features[i], jitters, kernels)
+
+
+@njit(fastmath=FASTMATH, cache=True)
+def _compute_information_coefficient(x, y, jitters, kernels):
+    """
+    Drop nan from x and y and compute information coefficient.
+    Arguments:
+        x (array): (n_samples)
+        y (array): (n_samples)
+        jitters (array): (2 * n_samples)
+        kernels (array): (2, N_GRIDS, n_samples); reused buffer
+    Returns:
+        float: information coefficient
+    """
+
+    x_ = empty(x.size)
+    y_ = empty(y.size)
+    n = 0
+    for j in range(x.size):
+        if not (isnan(x[j]) or isnan(y[j])):
+            x_[n] = x[j]
+            y_[n] = y[j]
+            n += 1
+
+    return _compute_information_coefficient_given_target(
+        _prepare_target(x_[:n], jitters), y_[:n], jitters, kernels)
+
+
+@njit(fastmath=FASTMATH, cache=True)
+def _prepare_target(x, jitters):
+    """
+    Jitter x and compute the quantities of information coefficient that depend
+        only on target.
+    Arguments:
+        x (array): (n_samples); without nan
+        jitters (array): (>= n_samples)
+    Returns:
+        tuple: (centered x (n_samples), sum of squared deviations, min, max,
+            bandwidth (0 if it can't be computed), differences between grids
+            and x (N_GRIDS, n_samples))
+    """
+
+    n = x.size
+
+    x_ = empty(n)
+    for j in range(n):
+        x_[j] = x[j] + jitters[j]
+
+    x_mean = 0.0
+    x_min = inf
+    x_max = -inf
+    for j in range(n):
+        x_mean += x_[j]
+        x_min = min(x_min, x_[j])
+        x_max = max(x_max, x_[j])
+    x_mean /= max(n, 1)
+
+    x_centered = empty(n)
+    x_variance = 0.0
+    for j in range(n):
+        x_centered[j] = x_[j] - x_mean
+        x_variance += x_centered[j]**2
+
+    if 3 <= n and 0 < x_variance:
+        bandwidth = _compute_bcv_bandwidth(x_)
+    else:
+        bandwidth = 0.0
+
+    x_grids = _make_grids(x_min, x_max)
+    x_differences = empty((N_GRIDS, n))
+    for g in range(N_GRIDS):
+        for j in range(n):
+            x_differences[g, j] = x_grids[g] - x_[j]
+
+    return x_centered, x_variance, x_min, x_max, bandwidth, x_differences
+
+
+@njit(fastmath=FASTMATH, cache=True)
+def _compute_information_coefficient_given_target(prepared_target, y,
+                                                  jitters, kernels):
+    """
+    Jitter y and compute information coefficient between prepared target and
+        y like compute_information_coefficient: bandwidths by MASS::bcv shrunk
+        by correlation and P(x, y) by MASS::kde2d.
+    Arguments:
+        prepared_target (tuple): returned by _prepare_target
+        y (array): (n_samples); without nan
+        jitters (array): (>= 2 * n_samples)
+        kernels (array): (2, N_GRIDS, >= n_samples); reused buffer for
+            Gaussian kernels of x and y on grids
+    Returns:
+        float: information coefficient
+    """
+
+    (x_centered, x_variance, x_min, x_max, x_bandwidth,
+     x_differences) = prepared_target
+
+    n = y.size
+
+    # Can't compute bandwidth with less than 3 values
+    if n < 3:
+        return 0.0
+
+    y_ = empty(n)
+    for j in range(n):
+        y_[j] = y[j] + jitters[n + j]
+
+    # Compute Pearson correlation
+    y_mean = 0.0
+    y_min = inf
+    y_max = -inf
+    for j in range(n):
+        y_mean += y_[j]
+        y_min = min(y_min, y_[j])
+        y_max = max(y_max, y_[j])
+    y_mean /= n
+
+    y_variance = 0.0
+    covariance = 0.0
+    for j in range(n):
+        y_variance += (y_[j] - y_mean)**2
+        covariance += x_centered[j] * (y_[j] - y_mean)
+
+    # Can't compute bandwidth with constant values (left constant by jitter)
+    if x_variance == 0 or y_variance == 0:
+        return 0.0
+
+    cor = max(-1.0, min(covariance / sqrt(x_variance * y_variance), 1.0))
+
+    # Compute bandwidths
+    bandwidth_x = x_bandwidth * (1 + (-0.75) * abs(cor))
+    bandwidth_y = _compute_bcv_bandwidth(y_) * (1 + (-0.75) * abs(cor))
+
+    # Compute Gaussian kernels on grids with MASS::kde2d bandwidth scale
+    h_x = bandwidth_x / 4
+    h_y = bandwidth_y / 4
+    y_grids = _make_grids(y_min, y_max)
+    kx = kernels[0]
+    ky = kernels[1]
+    for g in range(N_GRIDS):
+        for j in range(n):
+            kx[g, j] = exp(-0.5 * (x_differences[g, j] / h_x)**2)
+            ky[g, j] = exp(-0.5 * ((y_grids[g] - y_[j]) / h_y)**2)
+
+    # Compute P(x, y)
+    fxy = empty((N_GRIDS, N_GRIDS))
+    normalizer = 2 * pi * n * h_x * h_y
+    fxy_sum = 0.0
+    for gx in range(N_GRIDS):
+        for gy in range(N_GRIDS):
+            s = 0.0
+            for j in range(n):
+                s += kx[gx, j] * ky[gy, j]
+            fxy[gx, gy] = s / normalizer + EPS
+            fxy_sum += fxy[gx, gy]
+
+    # Compute P(x), P(y)
+    dx = (x_max - x_min) / (N_GRIDS - 1)
+    dy = (y_max - y_min) / (N_GRIDS - 1)
+    px = zeros(N_GRIDS)
+    py = zeros(N_GRIDS)
+    for gx in range(N_GRIDS):
+        for gy in range(N_GRIDS):
+            fxy[gx, gy] /= fxy_sum * dx * dy
+            px[gx] += fxy[gx, gy] * dy
+            py[gy] += fxy[gx, gy] * dx
+
+    # Compute mutual information
+    mi = 0.0
+    for gx in range(N_GRIDS):
+        for gy in range(N_GRIDS):
+            mi += fxy[gx, gy] * log(fxy[gx, gy] / (px[gx] * py[gy]))
+    mi *= dx * dy
+
+    # Compute information coefficient; mi is >= 0 but for rounding
+    ic = sqrt(1 - exp(-2 * max(mi, 0.0)))
+    if cor < 0:
+        return -ic
+    elif 0 < cor:
+        return ic
+    else:
+        return 0.0
+
+
+@njit(cache=True)
+def _make_grids(x_min, x_max):
+    """
+    Make N_GRIDS evenly spaced grids from x_min to x_max like R's seq.int.
+    Arguments:
+        x_min (float):
+        x_max (float):
+    Returns:
+        array: (N_GRIDS)
+    """
+
+    grids = empty(N_GRIDS)
+    grids[0] = x_min
+    grids[N_GRIDS - 1] = x_max
+
+    by = (x_max - x_min) / (N_GRIDS - 1)
+    for g in range(1, N_GRIDS - 1):
+        if g < N_GRIDS // 2:
+            grids[g] = x_min + g * by
+        else:
+            grids[g] = x_max - (N_GRIDS - 1 - g) * by
+
+    return grids
+
+
+# Without fast math to bin and optimize like MASS::bcv
+@njit(cache=True)
+def _compute_bcv_bandwidth(x):
+    """
+    Compute bandwidth of x by biased cross-validation like MASS::bcv.
+    Arguments:
+        x (array): (n_samples); 3 <= n_samples and not constant
+    Returns:
+        float: bandwidth
+    """
+
+    n = x.size
+
+    x_mean = 0.0
+    for j in range(n):
+        x_mean += x[j]
+    x_mean /= n
+
+    x_variance = 0.0
+    for j in range(n):
+        x_variance += (x[j] - x_mean)**2
+    x_variance /= n - 1
+
+    upper = 1.144 * sqrt(x_variance) * n**(-1 / 5) * 4
+    lower = 0.1 * upper
+
+    # Bin pairwise distances like VR_den_bin
+    x_min = x[0]
+    x_max = x[0]
+    for j in range(1, n):
+        x_min = min(x_min, x[j])
+        x_max = max(x_max, x[j])
+    d = (x_max - x_min) * 1.01 / N_BINS
+
+    bins = empty(n, dtype=int64)
+    for j in range(n):
+        bins[j] = _cast_to_c_int(x[j] / d)
+
+    counts = zeros(N_BINS, dtype=int64)
+    for i in range(1, n):
+        for j in range(i):
+            counts[min(abs(bins[i] - bins[j]), N_BINS - 1)] += 1
+
+    return _minimize_bcv_score(lower, upper, 0.1 * lower, n, d, counts)
+
+
+@njit(cache=True)
+def _cast_to_c_int(x):
+    """
+    Truncate x to int like C's (int) on x86-64, which gives INT_MIN when x is
+        out of int range.
+    Arguments:
+        x (float):
+    Returns:
+        int:
+    """
+
+    if -2147483649.0 < x < 2147483648.0:
+        return int(x)
+    else:
+        return -2147483648
+
+
+@njit(cache=True)
+def _compute_bcv_score(h, n, d, counts):
+    """
+    Compute biased cross-validation score of bandwidth h like VR_bcv_bin.
+    Arguments:
+        h (float): bandwidth
+        n (int): number of samples
+        d (float): bin width
+        counts (array): (N_BINS); pairwise distance counts
+    Returns:
+        float: score
+    """
+
+    hh = h / 4
+
+    s = 0.0
+    for i in range(counts.size):
+        delta = i * d / hh
+        delta *= delta
+        if 1000 <= delta:
+            break
+        s += exp(-delta / 4) * (delta * delta - 12 * delta + 12) * counts[i]
+
+    return (1 + s / (32.0 * n)) / (2.0 * n * hh * sqrt(pi))
+
+
+@njit(cache=True)
+def _minimize_bcv_score(a, b, tol, n, d, counts):
+    """
+    Minimize _compute_bcv_score over [a, b] with Brent's method like R's
+        optimize.
+    Arguments:
+        a (float): lower bound
+        b (float): upper bound
+        tol (float): tolerance
+        n (int): number of samples
+        d (float): bin width
+        counts (array): (N_BINS); pairwise distance counts
+    Returns:
+        float: bandwidth
+    """
+
+    # Squared inverse of golden ratio
+    c = (3 - sqrt(5)) * 0.5
+
+    eps = sqrt(EPS)
+
+    v = a + c * (b - a)
+    w = v
+    x = v
+
+    d_ = 0.0
+    e = 0.0
+    fx = _compute_bcv_score(x, n, d, counts)
+    fv = fx
+    fw = fx
+    tol3 = tol / 3
+
+    while True:
+        xm = (a + b) * 0.5
+        tol1 = eps * abs(x) + tol3
+        t2 = tol1 * 2
+
+        if abs(x - xm) <= t2 - (b - a) * 0.5:
+            break
+
+        p = 0.0
+        q = 0.0
+        r = 0.0
+        if tol1 < abs(e):
+
+            # Fit parabola
+            r = (x - w) * (fx - fv)
+            q = (x - v) * (fx - fw)
+            p = (x - v) * q - (x - w) * r
+            q = (q - r) * 2
+            if 0 < q:
+                p = -p
+            else:
+                q = -q
+            r = e
+            e = d_
+
+        if abs(q * 0.5 * r) <= abs(p) or p <= q * (a - x) or q * (b - x) <= p:
+
+            # Golden-section step
+            if x < xm:
+                e = b - x
+            else:
+                e = a - x
+            d_ = c * e
+
+        else:
+
+            # Parabolic-interpolation step, not too close to a or b
+            d_ = p / q
+            u = x + d_
+            if u - a < t2 or b - u < t2:
+                d_ = tol1
+                if xm <= x:
+                    d_ = -d_
+
+        # Not too close to x
+        if tol1 <= abs(d_):
+            u = x + d_
+        elif 0 < d_:
+            u = x + tol1
+        else:
+            u = x - tol1
+
+        fu = _compute_bcv_score(u, n, d, counts)
+
+        if fu <= fx:
+            if u < x:
+                b = x
+            else:
+                a = x
+            v = w
+            w = x
+            x = u
+            fv = fw
+            fw = fx
+            fx = fu
+        else:
+            if u < x:
+                a = u
+            else:
+                b = u
+            if fu <= fw or w == x:
+                v = w
+                fv = fw
+                w = u
+                fw = fu
+            elif fu <= fv or v == x or v == w:
+                v = u
+                fv = fu
+
+    return x
+
+
+@njit([
+    'float64[::1](float32[::1], float32[:, ::1], float64[::1], int64)',
+    'float64[::1](float64[::1], float64[:, ::1], float64[::1], int64)'
+],
+    parallel=True,
+    fastmath=FASTMATH,
+    cache=True)
+def _compute_information_coefficients(target, features, jitters, n_blocks):
+    """
+    Compute information coefficients between target and features[i] in
+        parallel over blocks of features.
+    Arguments:
+        target (array): (n_samples)
+        features (array): (n_features, n_samples)
+        jitters (array): (2 * n_samples)
+        n_blocks (int): number of feature blocks, each of which reuses its
+            buffer; 1 block per thread
+    Returns:
+        array: (n_features)
+    """
+
+    scores = empty(features.shape[0])
+
+    for b in prange(n_blocks):
+        start = b * features.shape[0] // n_blocks
+        stop = (b + 1) * features.shape[0] // n_blocks
+
+        _compute_information_coefficients_serially(
+            target, features[start:stop], jitters, scores[start:stop],
+            empty((2, N_GRIDS, target.size)))
+
+    return scores
+
+
+@njit([
+    'float64[:, ::1](float32[:, ::1], float32[:, ::1], float64[::1])',
+    'float64[:, ::1](float64[:, ::1], float64[:, ::1], float64[::1])'
+],
+    parallel=True,
+    fastmath=FASTMATH,
+    cache=True)
+def _compute_information_coefficients_for_targets(targets, features,
+                                                  jitters):
+    """
+    Compute information coefficients between targets[j] and features[i] in
+        parallel over targets.
+    Arguments:
+        targets (array): (n_targets, n_samples)
+        features (array): (n_features, n_samples)
+        jitters (array): (2 * n_samples)
+    Returns:
+        array: (n_features, n_targets)
+    """
+
+    scores = empty((features.shape[0], targets.shape[0]))
+
+    for j in prange(targets.shape[0]):
+        _compute_information_coefficients_serially(
+            targets[j], features, jitters, scores[:, j],
+            empty((2, N_GRIDS, targets.shape[1])))
+
+    return scores
+
+
+@njit([
+    'float64[:, ::1](float32[::1], float32[:, ::1], uint32[::1], '
+    'float64[::1], int64)',
+    'float64[:, ::1](float64[::1], float64[:, ::1], uint32[::1], '
+    'float64[::1], int64)'
+],
+    parallel=True,
+    fastmath=FASTMATH,
+    cache=True)
+def _permute_target_and_compute_information_coefficients(
+        target, features, random_seeds, jitters, n_blocks):
+    """
+    Permute target and compute information coefficients between each permuted
+        target and features[i] in parallel over blocks of permutations.
+    Arguments:
+        target (array): (n_samples)
+        features (array): (n_features, n_samples)
+        random_seeds (array): (n_permutations)
+        jitters (array): (2 * n_samples)
+        n_blocks (int): number of permutation blocks, each of which reuses its
+            buffers; 1 block per thread
+    Returns:
+        array: (n_features, n_permutations)
+    """
+
+    n_permutations = random_seeds.size
+
+    scores = empty((features.shape[0], n_permutations))
+
+    for b in prange(n_blocks):
+        permuted_target = empty_like(target)
+        kernels = empty((2, N_GRIDS, target.size))
+
+        for j in range(b * n_permutations // n_blocks,
+                       (b + 1) * n_permutations // n_blocks):
+
+            # Permute in place with Fisher-Yates shuffle
+            seed(random_seeds[j])
+            permuted_target[:] = target
+            for k in range(permuted_target.size - 1, 0, -1):
+                k_ = randint(0, k + 1)
+                permuted_target[k], permuted_target[k_] = permuted_target[
+                    k_], permuted_target[k]
+
+            # Score while permuted target is hot
+            _compute_information_coefficients_serially(
+                permuted_target, features, jitters, scores[:, j], kernels)
+
+    return scores
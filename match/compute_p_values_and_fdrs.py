@@ -0,0 +1,54 @@
+from numpy import (arange, argsort, clip, empty_like, minimum, searchsorted,
+                   sort, where)
+
+
+def compute_p_values_and_fdrs(values, random_values):
+    """
+    Compute empirical p-values and FDRs of values against random values.
+    Arguments:
+        values (array): (n)
+        random_values (array): (...); of any shape
+    Returns:
+        array: (n) p-values
+        array: (n) FDRs
+    """
+
+    n = random_values.size
+
+    # Count random values <= and >= each value with binary searches; sort
+    # flattened copy without flattening first
+    random_values = sort(random_values, axis=None)
+    p_values_l = searchsorted(random_values, values, side='right') / n
+    p_values_g = (n - searchsorted(random_values, values, side='left')) / n
+
+    # Empirical p-value can't be smaller than 1 / n
+    p_values_l = where(p_values_l == 0, 1 / n, p_values_l)
+    p_values_g = where(p_values_g == 0, 1 / n, p_values_g)
+
+    fdrs_l = compute_benjamini_hochberg_fdrs(p_values_l)
+    fdrs_g = compute_benjamini_hochberg_fdrs(p_values_g)
+
+    return minimum(p_values_l, p_values_g), minimum(fdrs_l, fdrs_g)
+
+
+def compute_benjamini_hochberg_fdrs(p_values):
+    """
+    Compute Benjamini-Hochberg FDRs.
+    Arguments:
+        p_values (array): (n)
+    Returns:
+        array: (n)
+    """
+
+    n = p_values.size
+
+    # Scale sorted p-values by n / rank and make them monotonic from the
+    # largest
+    indices = argsort(p_values)
+    scaled_p_values = p_values[indices] * n / arange(1, n + 1)
+    fdrs_sorted = minimum.accumulate(scaled_p_values[::-1])[::-1]
+
+    fdrs = empty_like(p_values)
+    fdrs[indices] = clip(fdrs_sorted, 0, 1)
+
+    return fdrs
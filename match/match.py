@@ -1,21 +1,30 @@
 from math import ceil
-
-from numpy import apply_along_axis, array, array_split, concatenate, empty
-from numpy.random import choice, get_state, seed, set_state, shuffle
-from pandas import DataFrame
-
+from os import W_OK, access, environ
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from joblib import Parallel, delayed
+from numpy import (array, ascontiguousarray, empty, float64, full, int32,
+                   linspace, memmap, nan, sqrt, tile)
+from numpy.random import SeedSequence, default_rng
+from pandas import DataFrame, Series
+from scipy.stats import norm
+
+from .compute_information_coefficients import (
+    compute_information_coefficients,
+    compute_information_coefficients_for_targets,
+    permute_target_and_compute_information_coefficients)
+from .compute_p_values_and_fdrs import compute_p_values_and_fdrs
 from .information.information.compute_information_coefficient import \
     compute_information_coefficient
-from .nd_array.nd_array.compute_empirical_p_values_and_fdrs import \
-    compute_empirical_p_values_and_fdrs
-from .nd_array.nd_array.compute_margin_of_error import compute_margin_of_error
 from .nd_array.nd_array.drop_nan_and_apply_function_on_2_1d_arrays import \
     drop_nan_and_apply_function_on_2_1d_arrays
-from .support.support.multiprocess import multiprocess
 from .support.support.series import get_top_and_bottom_series_indices
 
 RANDOM_SEED = 20121020
 
+SHARED_MEMORY_DIRECTORY_PATH = '/dev/shm'
+
 
 def match(target,
           features,
@@ -26,7 +35,8 @@ def match(target,
           n_samplings=30,
           confidence=0.95,
           n_permutations=30,
-          random_seed=RANDOM_SEED):
+          random_seed=RANDOM_SEED,
+          dtype=float64):
     """
     Compute: scores[i] = function(target, features[i]); compute margin of error
         (MoE), p-value, and FDR for n_features features.
@@ -46,57 +56,205 @@ def match(target,
         n_permutations (int): number of permutations for permutation test to
             compute p-values and FDR
         random_seed (int | array):
+        dtype (dtype): float64, or float32 to halve memory traffic of
+            compute_information_coefficient for values of order 1, such as
+            z-scores
     Returns:
         DataFrame: (n_features, 4 ['Score', '<confidence> MoE', 'p-value',
             'FDR'])
     """
 
-    results = DataFrame(
-        columns=['Score', '{} MoE'.format(confidence), 'p-value', 'FDR'])
+    if function is compute_information_coefficient:
+        # Information coefficient kernels read dtype so convert once
+        target = ascontiguousarray(target, dtype=dtype)
+        features = ascontiguousarray(features, dtype=dtype)
+
+    # Score, MoE, p-value, FDR
+    results = full((features.shape[0], 4), nan)
 
     # Match
     print('Computing match score with {} ({} process) ...'.format(
         function, n_jobs))
 
-    results['Score'] = concatenate(
-        multiprocess(match_target_and_features,
-                     [(target, fs, function)
-                      for fs in array_split(features, n_jobs)], n_jobs))
+    row_slices = split_rows(features.shape[0], n_jobs)
 
-    # Get top and bottom indices
-    indices = get_top_and_bottom_series_indices(results['Score'], n_features)
-    if max_n_features < indices.size:
-        indices = indices[:max_n_features // 2].append(
-            indices[-max_n_features // 2:])
+    results[:, 0] = multiprocess_into_shared_array(
+        match_target_and_features,
+        [(target, features[rs], function, dtype) for rs in row_slices],
+        row_slices,
+        (features.shape[0], ), n_jobs)
 
     # Compute MoE
-    if 3 <= n_samplings and 3 <= ceil(0.632 * target.size):
-
-        results.loc[indices, '{} MoE'.format(
-            confidence
-        )] = match_randomly_sampled_target_and_features_to_compute_margin_of_errors(
-            target,
-            features[indices],
-            function,
-            n_samplings=n_samplings,
-            confidence=confidence,
-            random_seed=random_seed)
+    if n_features is not None and 3 <= n_samplings and 3 <= ceil(
+            0.632 * target.size):
+
+        # Get top and bottom indices
+        indices = get_top_and_bottom_series_indices(
+            Series(results[:, 0]), n_features)
+        if max_n_features < indices.size:
+            indices = indices[:max_n_features // 2].append(
+                indices[-max_n_features // 2:])
+
+        results[indices, 1] = \
+            match_randomly_sampled_target_and_features_to_compute_margin_of_errors(
+                target,
+                features[indices],
+                function,
+                n_samplings=n_samplings,
+                confidence=confidence,
+                random_seed=random_seed,
+                dtype=dtype)
 
     # Compute p-value and FDR
-    if 1 <= n_permutations:
+    if n_features is not None and 1 <= n_permutations:
+
+        print('Computing p-values and FDRs with {} permutations ...'.format(
+            n_permutations))
+
+        # Split (feature, permutation) grid so that all jobs have work even
+        # with few features
+        tiles = split_grid(features.shape[0], n_permutations, n_jobs)
+
+        if function is compute_information_coefficient:
+            # Permute within kernel, seeding each permutation with its own
+            # seed so that tiles don't depend on n_jobs
+            random_seeds = SeedSequence(random_seed).generate_state(
+                n_permutations)
+
+            permutation_scores = multiprocess_into_shared_array(
+                permute_target_and_compute_information_coefficients,
+                [(target, features[fs], random_seeds[ps], dtype)
+                 for fs, ps in tiles], tiles,
+                (features.shape[0], n_permutations), n_jobs)
+
+        else:
+            permuted_targets = permute_target(target, n_permutations,
+                                              random_seed)
+
+            permutation_scores = multiprocess_into_shared_array(
+                match_targets_and_features,
+                [(permuted_targets[ps], features[fs], function, dtype)
+                 for fs, ps in tiles], tiles,
+                (features.shape[0], n_permutations), n_jobs)
+
+        results[:, 2], results[:, 3] = compute_p_values_and_fdrs(
+            results[:, 0], permutation_scores)
+
+    return DataFrame(
+        results,
+        columns=['Score', '{} MoE'.format(confidence), 'p-value', 'FDR'])
+
+
+def split_rows(n_rows, n_splits):
+    """
+    Split n_rows rows into n_splits contiguous row slices of similar sizes.
+    Arguments:
+        n_rows (int):
+        n_splits (int):
+    Returns:
+        list: [slice, ...]
+    """
+
+    boundaries = linspace(0, n_rows, n_splits + 1).astype(int).tolist()
+
+    return [
+        slice(start, stop)
+        for start, stop in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+
+def split_grid(n_rows, n_columns, n_splits):
+    """
+    Split n_rows x n_columns grid into about n_splits tiles of similar sizes,
+        splitting rows first and columns only when there are not enough rows.
+    Arguments:
+        n_rows (int):
+        n_columns (int):
+        n_splits (int):
+    Returns:
+        list: [(row slice, column slice), ...]
+    """
+
+    n_row_splits = max(1, min(n_splits, n_rows))
+    n_column_splits = max(1, min(ceil(n_splits / n_row_splits), n_columns))
+
+    return [(rs, cs)
+            for rs in split_rows(n_rows, n_row_splits)
+            for cs in split_rows(n_columns, n_column_splits)]
+
+
+def multiprocess_into_shared_array(function, args, indices, shape, n_jobs):
+    """
+    Multiprocess function(*args[i]) and write each result into array[indices[
+        i]] of a memory-mapped array instead of sending it back. Input arrays
+        larger than 1 MB are memory-mapped too instead of being pickled. Run
+        in this process without memory-mapping if n_jobs is 1.
+    Arguments:
+        function (callable):
+        args (iterable): [(arg, ...), ...]
+        indices (iterable): [index into array, ...]
+        shape (iterable): array shape
+        n_jobs (int): number of multiprocess jobs
+    Returns:
+        array: (shape)
+    """
+
+    if n_jobs == 1:
+        array_ = empty(tuple(shape))
+        for a, i in zip(args, indices):
+            array_[i] = function(*a)
+
+        return array_
+
+    with TemporaryDirectory(
+            dir=get_shared_memory_directory_path()) as directory_path:
+
+        shared_array = memmap(
+            join(directory_path, 'array'), dtype=float, mode='w+',
+            shape=tuple(shape))
+
+        Parallel(
+            n_jobs=n_jobs, max_nbytes='1M', temp_folder=directory_path)(
+                delayed(write_into_shared_array)(function, a, shared_array, i)
+                for a, i in zip(args, indices))
+
+        array_ = array(shared_array)
+        del shared_array
+
+    return array_
+
+
+def get_shared_memory_directory_path():
+    """
+    Get the directory joblib memory-maps into by default: JOBLIB_TEMP_FOLDER,
+        /dev/shm if it is writable, or the default temporary directory.
+    Arguments:
+        None
+    Returns:
+        str | None: None for the default temporary directory
+    """
+
+    directory_path = environ.get('JOBLIB_TEMP_FOLDER')
 
-        permutation_scores = concatenate(
-            multiprocess(permute_target_and_match_target_and_features,
-                         [(target, fs, function, n_permutations, random_seed)
-                          for fs in array_split(features, n_jobs)], n_jobs))
+    if directory_path is None and access(SHARED_MEMORY_DIRECTORY_PATH, W_OK):
+        directory_path = SHARED_MEMORY_DIRECTORY_PATH
 
-        p_values, fdrs = compute_empirical_p_values_and_fdrs(
-            results['Score'], permutation_scores.flatten())
+    return directory_path
 
-        results['p-value'] = p_values
-        results['FDR'] = fdrs
 
-    return results
+def write_into_shared_array(function, args, shared_array, index):
+    """
+    Compute function(*args) and write the result into shared_array[index].
+    Arguments:
+        function (callable):
+        args (iterable): (arg, ...)
+        shared_array (memmap):
+        index (slice | tuple): index into shared_array
+    Returns:
+        None
+    """
+
+    shared_array[index] = function(*args)
 
 
 def match_randomly_sampled_target_and_features_to_compute_margin_of_errors(
@@ -105,17 +263,20 @@ def match_randomly_sampled_target_and_features_to_compute_margin_of_errors(
         function,
         n_samplings=30,
         confidence=0.95,
-        random_seed=RANDOM_SEED):
+        random_seed=RANDOM_SEED,
+        dtype=float64):
     """
     Match randomly sampled target and features to compute margin of errors.
     Arguments
         target (array): (n_samples); must be 3 <= 0.632 * n_samples to compute
             MoE
-        features (array): (n_features, n_samples)
+        features (array): (n_features, n_samples); only the features to
+            compute MoE for
         function (callable):
         n_samplings (int): 3 <= n_samplings
         cofidence (float):
         random_seed (int | array):
+        dtype (dtype): float64, or float32 for values of order 1
     Returns:
         array: (n)
     """
@@ -128,33 +289,39 @@ def match_randomly_sampled_target_and_features_to_compute_margin_of_errors(
 
     print('Computing MoEs with {} samplings ...'.format(n_samplings))
 
-    feature_x_sampling = empty((features.shape[0], n_samplings))
+    n_sampled = ceil(0.632 * target.size)
+
+    # Write each sampling into a contiguous row
+    sampling_x_feature = empty((n_samplings, features.shape[0]))
 
-    seed(random_seed)
+    # Gather sampled features into the same buffer every sampling
+    sampled_features = empty((features.shape[0], n_sampled),
+                             dtype=features.dtype)
+
+    generator = default_rng(random_seed)
     for i in range(n_samplings):
 
         # Sample randomly
-        random_indices = choice(target.size, ceil(0.632 * target.size))
+        random_indices = generator.integers(
+            0, target.size, size=n_sampled, dtype=int32)
         sampled_target = target[random_indices]
-        sampled_features = features[:, random_indices]
-
-        random_state = get_state()
+        features.take(random_indices, axis=1, out=sampled_features)
 
         # Score
-        feature_x_sampling[:, i] = match_target_and_features(
-            sampled_target, sampled_features, function)
-
-        set_state(random_state)
+        sampling_x_feature[i] = match_target_and_features(
+            sampled_target, sampled_features, function, dtype)
 
     # Compute MoE using bootstrapped score distributions
-    return apply_along_axis(compute_margin_of_error, 1, feature_x_sampling)
+    return norm.ppf(q=confidence) * sampling_x_feature.std(axis=0) / sqrt(
+        n_samplings)
 
 
 def permute_target_and_match_target_and_features(target,
                                                  features,
                                                  function,
                                                  n_permutations=30,
-                                                 random_seed=RANDOM_SEED):
+                                                 random_seed=RANDOM_SEED,
+                                                 dtype=float64):
     """
     Permute target and match target and features.
     Arguments:
@@ -163,6 +330,7 @@ def permute_target_and_match_target_and_features(target,
         function (callable):
         n_permutations (int): 1 <= n_permutations
         random_seed (int | array):
+        dtype (dtype): float64, or float32 for values of order 1
     Returns:
         array: (n_features, n_permutations)
     """
@@ -174,42 +342,85 @@ def permute_target_and_match_target_and_features(target,
     print('Computing p-values and FDRs with {} permutations ...'.format(
         n_permutations))
 
-    feature_x_permutation = empty((features.shape[0], n_permutations))
-
-    # Copy for inplace shuffling
-    permuted_target = array(target)
-
-    seed(random_seed)
-    for i in range(n_permutations):
-        if i % ceil(5000 / features.shape[0]) == 0:
-            print('\t{}/{} ...'.format(i + 1, n_permutations))
+    if function is compute_information_coefficient:
+        return permute_target_and_compute_information_coefficients(
+            target, features,
+            SeedSequence(random_seed).generate_state(n_permutations), dtype)
 
-        # Permute
-        shuffle(permuted_target)
+    # Match
+    return match_targets_and_features(
+        permute_target(target, n_permutations, random_seed), features,
+        function, dtype)
 
-        random_state = get_state()
 
-        # Match
-        feature_x_permutation[:, i] = match_target_and_features(
-            permuted_target, features, function)
+def permute_target(target, n_permutations, random_seed=RANDOM_SEED):
+    """
+    Permute target n_permutations times.
+    Arguments:
+        target (array): (n_samples)
+        n_permutations (int):
+        random_seed (int | array):
+    Returns:
+        array: (n_permutations, n_samples)
+    """
 
-        set_state(random_state)
-    print('\t{}/{} - done.'.format(i + 1, n_permutations))
+    # Shuffle rows of tiled target in place with one call
+    permuted_targets = tile(target, (n_permutations, 1))
+    default_rng(random_seed).permuted(
+        permuted_targets, axis=1, out=permuted_targets)
 
-    return feature_x_permutation
+    return permuted_targets
 
 
-def match_target_and_features(target, features, function):
+def match_target_and_features(target, features, function, dtype=float64):
     """
     Drop nan from target and features[i] and compute: scores[i] = function(
-        target, features[i]).
+        target, features[i]). Use the vectorized implementation of function if
+        there is one.
     Arguments:
         target (array): (n_samples)
         features (array): (n_features, n_samples)
         function (callable):
+        dtype (dtype): float64, or float32 for values of order 1; only for
+            compute_information_coefficient
     Returns:
         array: (n_features)
     """
 
-    return apply_along_axis(drop_nan_and_apply_function_on_2_1d_arrays, 1,
-                            features, target, function)
+    if function is compute_information_coefficient:
+        return compute_information_coefficients(target, features, dtype)
+
+    scores = empty(features.shape[0])
+    for i in range(features.shape[0]):
+        scores[i] = drop_nan_and_apply_function_on_2_1d_arrays(
+            features[i], target, function)
+
+    return scores
+
+
+def match_targets_and_features(targets, features, function, dtype=float64):
+    """
+    Drop nan from targets[j] and features[i] and compute: scores[i, j] =
+        function(targets[j], features[i]). Use the vectorized implementation
+        of function if there is one.
+    Arguments:
+        targets (array): (n_targets, n_samples)
+        features (array): (n_features, n_samples)
+        function (callable):
+        dtype (dtype): float64, or float32 for values of order 1; only for
+            compute_information_coefficient
+    Returns:
+        array: (n_features, n_targets)
+    """
+
+    if function is compute_information_coefficient:
+        return compute_information_coefficients_for_targets(
+            targets, features, dtype)
+
+    scores = empty((features.shape[0], targets.shape[0]))
+    for j in range(targets.shape[0]):
+        scores[:, j] = match_target_and_features(targets[j], features,
+                                                 function, dtype)
+
+    return scores
+
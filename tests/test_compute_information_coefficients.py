@@ -0,0 +1,276 @@
+from numpy import (arange, bincount, clip, exp, finfo, float32, isnan, log,
+                   minimum, nan, outer, pi, sign, sqrt, tril_indices, trunc,
+                   where)
+from numpy.random import RandomState, default_rng
+from numpy.testing import assert_allclose
+from pytest import importorskip, mark
+from scipy.stats import norm, pearsonr
+
+from match.compute_information_coefficients import (
+    compute_information_coefficients,
+    compute_information_coefficients_for_targets)
+
+EPS = finfo(float).eps
+
+
+def make_target_and_features(n_samples=60):
+    """
+    Make float32-exact target and features with nan, constant, and n < 3
+        rows.
+    Arguments:
+        n_samples (int):
+    Returns:
+        array: (n_samples)
+        array: (8, n_samples)
+    """
+
+    generator = default_rng(20121020)
+
+    target = generator.normal(size=n_samples)
+    features = generator.normal(size=(8, n_samples))
+    features[:2] += target
+    features[2] -= target
+    features[3, ::7] = nan
+    features[4] = 1
+    features[5, :-2] = nan
+    features[6, 3:] = nan
+
+    return target.astype(float32).astype(float), features.astype(
+        float32).astype(float)
+
+
+def port_compute_information_coefficient(x, y, n_grids=25, jitter=1e-10):
+    """
+    Compute information coefficient like compute_information_coefficient,
+        with MASS::bcv and MASS::kde2d written out in NumPy and SciPy.
+    Arguments:
+        x (array): (n_samples)
+        y (array): (n_samples)
+        n_grids (int):
+        jitter (float):
+    Returns:
+        float: information coefficient
+    """
+
+    is_valid = ~(isnan(x) | isnan(y))
+    x = x[is_valid]
+    y = y[is_valid]
+
+    if x.size < 3:
+        return 0
+
+    random_state = RandomState(20121020)
+    x = x + random_state.random_sample(x.size) * jitter
+    y = y + random_state.random_sample(y.size) * jitter
+
+    cor = clip(pearsonr(x, y)[0], -1, 1)
+
+    # MASS::kde2d
+    h_x = port_bcv(x) * (1 - 0.75 * abs(cor)) / 4
+    h_y = port_bcv(y) * (1 - 0.75 * abs(cor)) / 4
+    x_grids = port_seq_int(x.min(), x.max(), n_grids)
+    y_grids = port_seq_int(y.min(), y.max(), n_grids)
+    fxy = norm.pdf((x_grids[:, None] - x) / h_x) @ norm.pdf(
+        (y_grids[:, None] - y) / h_y).T / (x.size * h_x * h_y) + EPS
+
+    dx = (x.max() - x.min()) / (n_grids - 1)
+    dy = (y.max() - y.min()) / (n_grids - 1)
+    pxy = fxy / (fxy.sum() * dx * dy)
+    px = pxy.sum(axis=1) * dy
+    py = pxy.sum(axis=0) * dx
+
+    mi = (pxy * log(pxy / outer(px, py))).sum() * dx * dy
+
+    return sign(cor) * sqrt(1 - exp(-2 * max(mi, 0)))
+
+
+def port_seq_int(from_, to, length_out):
+    """
+    Make grids like R's seq.int(from_, to, length.out=length_out), which
+        counts the upper half down from to.
+    Arguments:
+        from_ (float):
+        to (float):
+        length_out (int):
+    Returns:
+        array: (length_out)
+    """
+
+    by = (to - from_) / (length_out - 1)
+    i = arange(length_out)
+
+    return where(i < length_out // 2, from_ + i * by,
+                 to - (length_out - 1 - i) * by)
+
+
+def port_bcv(x, n_bins=1000):
+    """
+    Compute bandwidth like MASS::bcv(x), binning like VR_den_bin with C's
+        (int), which gives INT_MIN out of int range on x86-64.
+    Arguments:
+        x (array): (n_samples)
+        n_bins (int):
+    Returns:
+        float: bandwidth
+    """
+
+    n = x.size
+
+    upper = 1.144 * sqrt(x.var(ddof=1)) * n**(-1 / 5) * 4
+    lower = 0.1 * upper
+
+    d = (x.max() - x.min()) * 1.01 / n_bins
+    x_d = x / d
+    bins = where((-2**31 - 1 < x_d) & (x_d < 2**31), trunc(x_d),
+                 -2**31).astype(int)
+    i, j = tril_indices(n, -1)
+    counts = bincount(
+        minimum(abs(bins[i] - bins[j]), n_bins - 1), minlength=n_bins)
+
+    def compute_bcv_score(h):
+
+        hh = h / 4
+        delta = (arange(n_bins) * d / hh)**2
+        is_used = delta < 1000
+        delta = delta[is_used]
+        s = (exp(-delta / 4) * (delta * delta - 12 * delta + 12) *
+             counts[is_used]).sum()
+
+        return (1 + s / (32 * n)) / (2 * n * hh * sqrt(pi))
+
+    return port_optimize(compute_bcv_score, lower, upper, 0.1 * lower)
+
+
+def port_optimize(function, a, b, tol):
+    """
+    Minimize function over [a, b] like R's optimize (Brent_fmin).
+    Arguments:
+        function (callable):
+        a (float):
+        b (float):
+        tol (float):
+    Returns:
+        float: minimizer
+    """
+
+    c = (3 - sqrt(5)) * 0.5
+    eps = sqrt(EPS)
+
+    v = w = x = a + c * (b - a)
+    d = e = 0
+    fv = fw = fx = function(x)
+
+    while True:
+        xm = (a + b) * 0.5
+        tol1 = eps * abs(x) + tol / 3
+        t2 = tol1 * 2
+
+        if abs(x - xm) <= t2 - (b - a) * 0.5:
+            return x
+
+        p = q = r = 0
+        if tol1 < abs(e):
+            r = (x - w) * (fx - fv)
+            q = (x - v) * (fx - fw)
+            p = (x - v) * q - (x - w) * r
+            q = (q - r) * 2
+            if 0 < q:
+                p = -p
+            else:
+                q = -q
+            r = e
+            e = d
+
+        if abs(q * 0.5 * r) <= abs(p) or p <= q * (a - x) or q * (b - x) <= p:
+            e = b - x if x < xm else a - x
+            d = c * e
+        else:
+            d = p / q
+            u = x + d
+            if u - a < t2 or b - u < t2:
+                d = -tol1 if xm <= x else tol1
+
+        if tol1 <= abs(d):
+            u = x + d
+        else:
+            u = x + tol1 if 0 < d else x - tol1
+
+        fu = function(u)
+
+        if fu <= fx:
+            if u < x:
+                b = x
+            else:
+                a = x
+            v, w, x = w, x, u
+            fv, fw, fx = fw, fx, fu
+        else:
+            if u < x:
+                a = u
+            else:
+                b = u
+            if fu <= fw or w == x:
+                v, w = w, u
+                fv, fw = fw, fu
+            elif fu <= fv or v == x or v == w:
+                v = u
+                fv = fu
+
+
+@mark.parametrize('has_nan', [False, True])
+def test_compute_information_coefficients_matches_reference(has_nan):
+
+    compute_information_coefficient = importorskip(
+        'match.information.information.compute_information_coefficient'
+    ).compute_information_coefficient
+
+    target, features = make_target_and_features()
+    if has_nan:
+        target = where(arange(target.size) % 9 == 0, nan, target)
+
+    assert_allclose(
+        compute_information_coefficients(target, features), [
+            compute_information_coefficient(target, feature)
+            for feature in features
+        ],
+        atol=1e-6)
+
+
+@mark.parametrize('has_nan', [False, True])
+def test_compute_information_coefficients_matches_port(has_nan):
+
+    target, features = make_target_and_features()
+    if has_nan:
+        target = where(arange(target.size) % 9 == 0, nan, target)
+
+    scores = [
+        port_compute_information_coefficient(target, feature)
+        for feature in features
+    ]
+
+    assert_allclose(
+        compute_information_coefficients(target, features), scores, atol=1e-9)
+
+    assert_allclose(
+        compute_information_coefficients_for_targets(
+            target[None], features)[:, 0],
+        scores,
+        atol=1e-9)
+
+
+@mark.parametrize('offset', [0, 1])
+def test_compute_information_coefficients_reads_float32_within_tolerance(
+        offset):
+
+    generator = default_rng(20121020)
+
+    target = generator.normal(size=100)
+    features = generator.normal(size=(200, 100))
+    features[:50] += target
+    features[::7, ::5] = nan
+
+    assert_allclose(
+        compute_information_coefficients(
+            target + offset, features + offset, dtype=float32),
+        compute_information_coefficients(target + offset, features + offset),
+        atol=1e-7)
@@ -0,0 +1,50 @@
+from numpy import array, concatenate, maximum, minimum
+from numpy.random import default_rng
+from numpy.testing import assert_allclose
+from pytest import mark
+from scipy.stats import false_discovery_control
+
+from match.compute_p_values_and_fdrs import (compute_benjamini_hochberg_fdrs,
+                                             compute_p_values_and_fdrs)
+
+
+@mark.parametrize('p_values', [
+    default_rng(20121020).uniform(size=100),
+    default_rng(20121020).uniform(high=0.05, size=100),
+    array([0.5, 0.01, 0.04, 0.01, 0.04, 0.04, 1, 0.5]),
+    array([0.2, 0.2, 0.2]),
+    array([0.03]),
+])
+def test_compute_benjamini_hochberg_fdrs_matches_scipy(p_values):
+
+    assert_allclose(
+        compute_benjamini_hochberg_fdrs(p_values),
+        false_discovery_control(p_values, method='bh'))
+
+
+def test_compute_p_values_and_fdrs_matches_counts():
+
+    generator = default_rng(20121020)
+
+    # Rounded so that values tie with random values, some of which fall
+    # outside the random range
+    random_values = generator.normal(size=(20, 30)).round(1)
+    values = concatenate((generator.choice(random_values.ravel(), size=10),
+                          generator.normal(size=10).round(1),
+                          [random_values.min(),
+                           random_values.max(), -9, 9]))
+
+    n = random_values.size
+    p_values_l = maximum(
+        (random_values.ravel() <= values[:, None]).sum(axis=1), 1) / n
+    p_values_g = maximum(
+        (values[:, None] <= random_values.ravel()).sum(axis=1), 1) / n
+
+    p_values, fdrs = compute_p_values_and_fdrs(values, random_values)
+
+    assert_allclose(p_values, minimum(p_values_l, p_values_g))
+    assert_allclose(
+        fdrs,
+        minimum(
+            false_discovery_control(p_values_l, method='bh'),
+            false_discovery_control(p_values_g, method='bh')))